@@ -1,16 +1,75 @@
 import sys
+import atexit
 import socket
+import selectors
 import threading
 import logging
+import logging.handlers
+import queue
 import json
+import ast
 import time
 import os
 import platform
+import copy
+import io
 import colorama
+from collections import deque
+from itertools import islice
 from datetime import datetime
+from enum import IntEnum
 from typing import Optional, Dict, List, Callable
 from dataclasses import dataclass
 from colorama import Fore, Back, Style
+from framing import iter_frames
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+PREFS_FILE = 'preferences.conf'  # Python dict literal, parsed with ast.literal_eval
+LEGACY_PREFS_FILE = 'preferences.json'  # read once to migrate, and the /exportprefs default
+
+# Process-wide log listener; every ChatClient shares it
+_LOG_LISTENER: Optional[logging.handlers.QueueListener] = None
+
+# Parsed preferences keyed by (path, mtime) so repeated loads skip the disk
+_PREFS_CACHE: Dict[tuple, Dict] = {}
+
+# Number of arguments each client command accepts; the last one takes the rest of the line
+_CMD_ARGC = {
+    '/theme': 1,
+    '/export': 1,
+    '/exportprefs': 1,
+    '/filter': 1,
+}
+
+_IS_WINDOWS = platform.system() == 'Windows'
+_CLEAR_CMD = 'cls' if _IS_WINDOWS else 'clear'
+
+RECV_CHUNK = 16384
+MAX_FRAME_BYTES = 65536  # longest message accepted from the server
+_EXIT_TOKENS = frozenset({"bye", "quit"})
+RESET = Style.RESET_ALL
+
+def _hms(timestamp: datetime, _cache=[None, ""]) -> str:
+    """Format a timestamp as HH:MM:SS, reusing the last result for the same second"""
+    key = (timestamp.hour, timestamp.minute, timestamp.second)
+    if key != _cache[0]:
+        _cache[0] = key
+        _cache[1] = timestamp.strftime("%H:%M:%S")
+    return _cache[1]
+
+class MsgType(IntEnum):
+    """Kind of chat message, used to index per-theme render tables"""
+    NORMAL = 0
+    SYSTEM = 1
+    PRIVATE = 2
+    ERROR = 3
+
+# Theme element that colors each message type, in MsgType order
+MSG_TYPE_ELEMENTS = ('message', 'system', 'private', 'error')
 
 @dataclass
 class Message:
@@ -18,7 +77,7 @@ class Message:
     content: str
     sender: str
     timestamp: datetime
-    type: str = "normal"  # normal, system, private, error
+    type: MsgType = MsgType.NORMAL
     recipient: str = None
 
 class ChatTheme:
@@ -50,19 +109,31 @@ class ChatTheme:
     
     def __init__(self, theme_name: str = "default"):
         self.current_theme = self.THEMES.get(theme_name, self.THEMES["default"])
+        self.plain_formats: List[str] = []
+        self.stamped_formats: List[str] = []
+        self.precompute()
         
     def get_color(self, element: str) -> str:
-        return self.current_theme.get(element, Style.RESET_ALL)
+        return self.current_theme.get(element, RESET)
+
+    def precompute(self):
+        """Build the %-format templates for each message type, indexed by MsgType"""
+        timestamp_color = self.get_color('timestamp')
+        colors = [self.get_color(element) for element in MSG_TYPE_ELEMENTS]
+        self.plain_formats = [f"{color}%s{RESET}" for color in colors]
+        self.stamped_formats = [f"{timestamp_color}[%s] {color}%s{RESET}" for color in colors]
 
 class ChatClient:
     def __init__(self, host: str = "localhost", port: int = 25000):
         self.host = host
         self.port = port
         self.socket: Optional[socket.socket] = None
+        self._rx_buf = bytearray()
+        self._stdin_buf = bytearray()
+        self._closed = False
         self.running = False
         self.username = None
         self.last_active = time.time()
-        self.message_history: List[Message] = []
         self.max_history = 100
         self.version = "2.1.0"
         self.theme = None
@@ -77,6 +148,10 @@ class ChatClient:
         # Load user preferences if they exist
         self.preferences = self._load_preferences()
         
+        # Bounded history: deque drops the oldest entry in O(1) once full
+        self.max_history = self.preferences.get("max_history", self.max_history)
+        self.message_history: deque = deque(maxlen=self.max_history)
+        
         # Initialize theme
         self.theme = ChatTheme(self.preferences.get("theme", "default"))
         
@@ -84,19 +159,29 @@ class ChatClient:
         self._register_commands()
 
     def _setup_logging(self):
-        """Configure detailed logging"""
-        log_format = '%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-        logging.basicConfig(
-            level=logging.INFO,
-            format=log_format,
-            handlers=[
-                logging.FileHandler('chat_client.log', encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        """Configure detailed logging once per process"""
+        global _LOG_LISTENER
+        if _LOG_LISTENER is not None:
+            return
+        
+        log_format = logging.Formatter('%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
+        file_handler = logging.FileHandler('chat_client.log', encoding='utf-8')
+        stream_handler = logging.StreamHandler()
+        file_handler.setFormatter(log_format)
+        stream_handler.setFormatter(log_format)
+        
+        # Log calls only enqueue; a background listener does the actual writes
+        log_queue = queue.Queue(-1)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter('%(message)s'))
+        _LOG_LISTENER = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+        _LOG_LISTENER.start()
+        atexit.register(_LOG_LISTENER.stop)  # drain queued records before exit
+        
+        logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 
     def _load_preferences(self) -> Dict:
-        """Load user preferences from JSON file"""
+        """Load user preferences, migrating from the legacy JSON file if needed"""
         default_prefs = {
             "show_timestamps": True,
             "save_history": True,
@@ -105,23 +190,56 @@ class ChatClient:
             "max_history": 100
         }
         
-        try:
-            if os.path.exists('preferences.json'):
-                with open('preferences.json', 'r') as f:
-                    return {**default_prefs, **json.load(f)}
-        except Exception as e:
-            logging.warning(f"Could not load preferences: {e}")
+        for path in (PREFS_FILE, LEGACY_PREFS_FILE):
+            try:
+                key = (path, os.stat(path).st_mtime_ns)
+                if key not in _PREFS_CACHE:
+                    _PREFS_CACHE[key] = {**default_prefs, **self._read_preferences(path)}
+                return copy.deepcopy(_PREFS_CACHE[key])
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logging.warning(f"Could not load preferences from {path}: {e}")
         
         return default_prefs
 
+    def _read_preferences(self, path: str) -> Dict:
+        """Parse a literal or JSON preferences file"""
+        if path == PREFS_FILE:
+            with open(path, 'r', encoding='utf-8') as f:
+                prefs = ast.literal_eval(f.read())
+            if not isinstance(prefs, dict):
+                raise ValueError(f"{path} does not contain a dict")
+            return prefs
+        with open(path, 'rb') as f:
+            data = f.read()
+        if orjson:
+            return orjson.loads(data)
+        return json.loads(data)
+
     def _save_preferences(self):
-        """Save user preferences to JSON file"""
+        """Save user preferences as a Python dict literal"""
+        for key in [key for key in _PREFS_CACHE if key[0] == PREFS_FILE]:
+            del _PREFS_CACHE[key]
         try:
-            with open('preferences.json', 'w') as f:
-                json.dump(self.preferences, f, indent=4)
+            with open(PREFS_FILE, 'w', encoding='utf-8') as f:
+                f.write(repr(self.preferences))
         except Exception as e:
             logging.error(f"Could not save preferences: {e}")
 
+    def _export_preferences(self, filename: str = LEGACY_PREFS_FILE):
+        """Export user preferences as human-readable JSON"""
+        try:
+            if orjson:
+                with open(filename, 'wb') as f:
+                    f.write(orjson.dumps(self.preferences, option=orjson.OPT_INDENT_2))
+            else:
+                with open(filename, 'w') as f:
+                    json.dump(self.preferences, f, indent=4)
+            self._system_message(f"Preferences exported to {filename}")
+        except Exception as e:
+            self._error_message(f"Failed to export preferences: {e}")
+
     def _register_commands(self):
         """Register all available chat commands"""
         self.command_handlers = {
@@ -133,12 +251,13 @@ class ChatClient:
             '/status': self._show_status,
             '/theme': self._change_theme,
             '/export': self._export_history,
+            '/exportprefs': self._export_preferences,
             '/filter': self._filter_history,
         }
 
     def display_welcome_screen(self):
         """Display a professional welcome screen"""
-        os.system('cls' if platform.system() == 'Windows' else 'clear')
+        os.system(_CLEAR_CMD)
         header_color = self.theme.get_color('header')
         print(f"{header_color}")
         print("╔══════════════════════════════════════════╗")
@@ -159,6 +278,7 @@ class ChatClient:
                 self.socket.settimeout(10)  # 10 second timeout for initial connection
                 self.socket.connect((self.host, self.port))
                 self.socket.settimeout(None)  # Remove timeout for regular operations
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Send typed lines immediately
                 self.running = True
                 self._system_message("Successfully connected to server!")
                 return True
@@ -175,7 +295,7 @@ class ChatClient:
         self._error_message(f"Failed to connect after {max_retries} attempts.")
         return False
 
-    def _create_message(self, content: str, msg_type: str = "normal", recipient: str = None) -> Message:
+    def _create_message(self, content: str, msg_type: MsgType = MsgType.NORMAL, recipient: str = None) -> Message:
         """Create a new message object"""
         return Message(
             content=content,
@@ -185,24 +305,26 @@ class ChatClient:
             recipient=recipient
         )
 
+    def _format_message(self, message: Message) -> str:
+        """Render a message with the current theme"""
+        if not self.preferences.get("show_timestamps", True):
+            return self.theme.plain_formats[message.type] % message.content
+        timestamp = _hms(message.timestamp)
+        return self.theme.stamped_formats[message.type] % (timestamp, message.content)
+
     def _print_message(self, message: Message):
         """Print a formatted message"""
-        if not self.preferences.get("show_timestamps", True):
-            formatted = f"{self.theme.get_color(message.type)}{message.content}{Style.RESET_ALL}"
-        else:
-            timestamp = message.timestamp.strftime("%H:%M:%S")
-            formatted = f"{self.theme.get_color('timestamp')}[{timestamp}] {self.theme.get_color(message.type)}{message.content}{Style.RESET_ALL}"
-        print(formatted)
+        print(self._format_message(message))
 
     def _system_message(self, content: str):
         """Print a system message"""
-        msg = self._create_message(content, "system")
+        msg = self._create_message(content, MsgType.SYSTEM)
         self._print_message(msg)
         self._add_to_history(msg)
 
     def _error_message(self, content: str):
         """Print an error message"""
-        msg = self._create_message(content, "error")
+        msg = self._create_message(content, MsgType.ERROR)
         self._print_message(msg)
         self._add_to_history(msg)
 
@@ -210,26 +332,25 @@ class ChatClient:
         """Add message to history with limit checking"""
         if self.preferences.get("save_history", True):
             self.message_history.append(message)
-            while len(self.message_history) > self.max_history:
-                self.message_history.pop(0)
 
     def _handle_commands(self, message: str) -> bool:
         """Handle client-side commands"""
-        parts = message.split()
-        command = parts[0].lower()
-        args = parts[1:] if len(parts) > 1 else []
+        head, *rest = message.split(None, 1)
+        command = head.lower()
+        rest = rest[0] if rest else ""
         
-        if command in self.command_handlers:
-            if args:
-                self.command_handlers[command](*args)
-            else:
-                self.command_handlers[command]()
-            return True
-        return False
+        handler = self.command_handlers.get(command)
+        if handler is None:
+            return False
+        
+        argc = _CMD_ARGC.get(command, 0)
+        args = rest.split(None, argc - 1) if argc else []
+        handler(*args)
+        return True
 
     def _clear_screen(self):
         """Clear the terminal screen"""
-        os.system('cls' if platform.system() == 'Windows' else 'clear')
+        os.system(_CLEAR_CMD)
         self._system_message("Screen cleared.")
 
     def _show_help(self):
@@ -250,10 +371,13 @@ class ChatClient:
 {command_color}/status{reset_color} - Show connection status
 {command_color}/theme <theme_name>{reset_color} - Change color theme
 {command_color}/export [filename]{reset_color} - Export chat history
+{command_color}/exportprefs [filename]{reset_color} - Export preferences as JSON
 {command_color}/filter <text>{reset_color} - Filter message history
 {command_color}BYE{reset_color} or {command_color}bye{reset_color} - Exit application
+
 """
-        print(help_text)
+        sys.stdout.write(help_text)
+        sys.stdout.flush()
 
     def _show_history(self):
         """Display message history"""
@@ -261,15 +385,27 @@ class ChatClient:
             self._system_message("No message history available.")
             return
             
-        print(f"{self.theme.get_color('header')}Message History:{Style.RESET_ALL}")
-        for msg in self.message_history[-20:]:  # Show last 20 messages
-            self._print_message(msg)
+        buf = io.StringIO()
+        buf.write(f"{self.theme.get_color('header')}Message History:{Style.RESET_ALL}\n")
+        start = max(0, len(self.message_history) - 20)
+        for msg in islice(self.message_history, start, None):  # Show last 20 messages
+            buf.write(self._format_message(msg))
+            buf.write("\n")
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
 
     def _show_preferences(self):
         """Display current user preferences"""
-        print(f"{self.theme.get_color('header')}Current Preferences:{Style.RESET_ALL}")
-        for key, value in self.preferences.items():
-            print(f"{self.theme.get_color('command')}{key}: {self.theme.get_color('message')}{value}{Style.RESET_ALL}")
+        key_color = self.theme.get_color('command')
+        value_color = self.theme.get_color('message')
+        buf = io.StringIO()
+        buf.write(f"{self.theme.get_color('header')}Current Preferences:{Style.RESET_ALL}\n")
+        buf.write("".join(
+            f"{key_color}{key}: {value_color}{value}{Style.RESET_ALL}\n"
+            for key, value in self.preferences.items()
+        ))
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
 
     def _show_status(self):
         """Display connection status and statistics"""
@@ -285,8 +421,10 @@ Connected for: {hours:02d}:{minutes:02d}:{seconds:02d}
 Messages in history: {len(self.message_history)}
 Client version: {self.version}
 Current theme: {self.preferences.get('theme', 'default')}
+
 """
-        print(status)
+        sys.stdout.write(status)
+        sys.stdout.flush()
 
     def _change_theme(self, theme_name: str = None):
         """Change the chat theme"""
@@ -323,36 +461,113 @@ Current theme: {self.preferences.get('theme', 'default')}
             self._error_message("Usage: /filter <text>")
             return
             
-        filtered_messages = [
-            msg for msg in self.message_history 
-            if filter_text.lower() in msg.content.lower()
-        ]
+        # Only the last 20 matches are shown, so keep just those
+        needle = filter_text.lower()
+        filtered_messages = deque(
+            (msg for msg in self.message_history if needle in msg.content.lower()),
+            maxlen=20
+        )
         
         if not filtered_messages:
             self._system_message("No matching messages found")
             return
             
-        print(f"\n{self.theme.get_color('header')}Filtered Messages:{Style.RESET_ALL}")
-        for msg in filtered_messages[-20:]:
+        buf = io.StringIO()
+        buf.write(f"\n{self.theme.get_color('header')}Filtered Messages:{Style.RESET_ALL}\n")
+        for msg in filtered_messages:
+            buf.write(self._format_message(msg))
+            buf.write("\n")
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
+
+    def _receive_ready(self):
+        """Read from the socket once and display every complete message"""
+        for frame in iter_frames(self.socket, self._rx_buf, RECV_CHUNK, MAX_FRAME_BYTES):
+            message = frame.decode("utf8")
+            if not message:
+                continue
+            
+            msg_type = MsgType.PRIVATE if "whispered to you:" in message else MsgType.NORMAL
+            msg = self._create_message(message, msg_type)
+            
+            print(f"\r", end="")  # Clear current line
             self._print_message(msg)
+            self._add_to_history(msg)
+        
+        print("\nYou: ", end="", flush=True)
+
+    def _stdin_ready(self):
+        """Read whatever the user has typed and process every complete line"""
+        data = os.read(sys.stdin.fileno(), RECV_CHUNK)
+        if not data:
+            raise EOFError("stdin closed")
+        self._stdin_buf.extend(data)
+        
+        while (i := self._stdin_buf.find(b"\n")) != -1:
+            line = bytes(self._stdin_buf[:i]).decode("utf8", errors="replace")
+            del self._stdin_buf[:i + 1]
+            self._handle_input(line)
+            if not self.running:
+                return
+        
+        print("\nYou: ", end="", flush=True)
+
+    def _handle_input(self, message: str):
+        """Process one line of user input as a command or an outgoing message"""
+        message = message.strip()
+        
+        if len(message) <= 4 and message.lower() in _EXIT_TOKENS:
+            self._system_message("Closing the chat application...")
+            self.socket.sendall(b"/quit\n")
+            self.shutdown()
+            return
+        
+        if not message:
+            return
+        
+        if message.startswith('/'):
+            if self._handle_commands(message):
+                return
+        
+        self.socket.sendall(message.encode("utf8") + b"\n")
+        self.last_active = time.time()
+        sys.stdout.write("\033[F\033[K")  # Clear previous line
+
+    def _event_loop(self):
+        """Serve the server socket and stdin from a single selector loop"""
+        selector = selectors.DefaultSelector()
+        selector.register(self.socket, selectors.EVENT_READ, self._receive_ready)
+        try:
+            selector.register(sys.stdin, selectors.EVENT_READ, self._stdin_ready)
+        except OSError:
+            # epoll rejects regular files, e.g. stdin redirected from a file
+            selector.close()
+            self._run_threaded()
+            return
+        
+        print("\nYou: ", end="", flush=True)
+        try:
+            while self.running:
+                for key, _ in selector.select(timeout=0.1):
+                    key.data()
+                    if not self.running:
+                        break
+        except EOFError:
+            pass
+        except Exception as e:
+            if self.running:
+                logging.error(f"Error in client event loop: {e}")
+        finally:
+            selector.close()
+            self.running = False
 
     def _receive_messages(self):
         """Handle incoming messages with improved error handling"""
         while self.running:
             try:
-                message = self.socket.recv(2048).decode("utf8")
-                if not message:
-                    break
-                
-                msg_type = "private" if "whispered to you:" in message else "normal"
-                msg = self._create_message(message, msg_type)
-                
-                print(f"\r", end="")  # Clear current line
-                self._print_message(msg)
-                self._add_to_history(msg)
-                
-                print("\nYou: ", end="", flush=True)
-                
+                self._receive_ready()
+            except EOFError:
+                break
             except Exception as e:
                 if self.running:
                     logging.error(f"Error receiving message: {e}")
@@ -362,25 +577,7 @@ Current theme: {self.preferences.get('theme', 'default')}
         """Handle outgoing messages with command processing"""
         while self.running:
             try:
-                message = input("\nYou: ").strip()
-                
-                if message.lower() in ["bye", "quit"]:
-                    self._system_message("Closing the chat application...")
-                    self.socket.send("/quit".encode("utf8"))
-                    self.shutdown()
-                    os._exit(0)
-                
-                if not message:
-                    continue
-                
-                if message.startswith('/'):
-                    if self._handle_commands(message):
-                        continue
-                
-                self.socket.send(message.encode("utf8"))
-                self.last_active = time.time()
-                sys.stdout.write("\033[F\033[K")  # Clear previous line
-                
+                self._handle_input(input("\nYou: "))
             except Exception as e:
                 if self.running:
                     logging.error(f"Error sending message: {e}")
@@ -392,7 +589,19 @@ Current theme: {self.preferences.get('theme', 'default')}
         
         if not self.connect():
             return
+        
+        # select() only accepts sockets on Windows, so stdin keeps its own thread there
+        if _IS_WINDOWS:
+            self._run_threaded()
+            return
+        
+        try:
+            self._event_loop()
+        except KeyboardInterrupt:
+            self.shutdown()
 
+    def _run_threaded(self):
+        """Run separate receive and input threads"""
         receive_thread = threading.Thread(target=self._receive_messages)
         send_thread = threading.Thread(target=self._send_messages)
         
@@ -411,6 +620,9 @@ Current theme: {self.preferences.get('theme', 'default')}
 
     def shutdown(self):
         """Clean shutdown of client"""
+        if self._closed:
+            return
+        self._closed = True
         self.running = False
         if self.socket:
             try:
@@ -426,10 +638,10 @@ def main():
     try:
         client.start()
     except KeyboardInterrupt:
-        print(f"\n{ChatTheme.SYSTEM}Closing client...{ChatTheme.RESET}")
+        print(f"\n{client.theme.get_color('system')}Closing client...{RESET}")
     finally:
         client.shutdown()
-        print(f"{ChatTheme.SUCCESS}You can now close the application.{ChatTheme.RESET}")
+        print(f"{client.theme.get_color('success')}You can now close the application.{RESET}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
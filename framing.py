@@ -0,0 +1,19 @@
+# framing.py
+import socket
+from typing import Iterator
+
+def iter_frames(sock: socket.socket, buf: bytearray, chunk: int, max_frame: int) -> Iterator[bytes]:
+    """Yield every complete newline-delimited frame, reading from the socket only when none is buffered"""
+    if buf.find(b"\n") == -1:
+        data = sock.recv(chunk)
+        if not data:
+            raise EOFError("Connection closed by peer")
+        buf.extend(data)
+    while (i := buf.find(b"\n")) != -1:
+        if i > max_frame:
+            raise ValueError(f"Frame exceeds {max_frame} bytes")
+        frame = bytes(buf[:i])
+        del buf[:i + 1]
+        yield frame
+    if len(buf) > max_frame:
+        raise ValueError(f"Frame exceeds {max_frame} bytes")
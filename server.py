@@ -1,18 +1,70 @@
 # server.py
 import atexit
 import socket
+import selectors
 import threading
 import logging
-from datetime import datetime
-from typing import Dict, Optional
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Set
+from framing import iter_frames
+
+RECV_CHUNK = 65536
+BATCH_INTERVAL = 0.02  # seconds broadcasts may wait before being flushed
+BATCH_FLUSH_BYTES = 4096  # flush a client's outbox early once it holds this much
+MAX_OUTBOX_BYTES = 1024 * 1024  # disconnect clients that let this much output back up
+MAX_FRAME_BYTES = 8192  # longest message a client may send
+
+def _hms_now(_cache=[0, ""]) -> str:
+    """Current local time as HH:MM:SS, formatted at most once per second"""
+    now = int(time.time())
+    if now != _cache[0]:
+        _cache[0] = now
+        _cache[1] = time.strftime("%H:%M:%S", time.localtime(now))
+    return _cache[1]
+
+@dataclass
+class ClientState:
+    """Per-connection state stored on the selector key"""
+    buffer: bytearray = field(default_factory=bytearray)
+    outbox: bytearray = field(default_factory=bytearray)
+    username: Optional[str] = None
 
 class ChatServer:
+    # Static replies, framed and encoded once
+    _MSG_ASK_USERNAME = b"Enter your username:\n"
+    _MSG_USERNAME_RETRY = b"Username already taken or invalid. Try again.\n" + _MSG_ASK_USERNAME
+    _MSG_GOODBYE = b"Goodbye!\n"
+    _MSG_UNKNOWN_COMMAND = b"Unknown command. Type /help for available commands.\n"
+    _MSG_WHISPER_USAGE = b"Usage: /whisper <username> <message>\n"
+    # Each help line goes out as its own frame
+    _MSG_HELP = (
+        b"Available commands:\n"
+        b"/help - Show this help message\n"
+        b"/online - Show online users\n"
+        b"/quit - Leave the chat\n"
+        b"/whisper <username> <message> - Send private message\n"
+    )
+
     def __init__(self, host: str = "", port: int = 25000):
         self.host = host
         self.port = port
         self.users: Dict[socket.socket, str] = {}
+        self.names: Dict[str, socket.socket] = {}
+        self._sockets_snapshot: tuple = ()  # broadcast targets, rebuilt on join/leave
         self.addresses: Dict[socket.socket, tuple] = {}
         self.server_socket: Optional[socket.socket] = None
+        self.selector = selectors.DefaultSelector()
+        self._pending: Set[socket.socket] = set()
+        
+        # Command handlers all take (client, command, username)
+        self.commands: Dict[str, Callable[[socket.socket, str, str], None]] = {
+            '/quit': self._handle_quit,
+            '/online': self._show_online_users,
+            '/help': self._show_help,
+            '/whisper': self._handle_whisper,
+        }
+        self._flush_deadline = 0.0
         self.running = False
         
         # Set up logging
@@ -32,111 +84,122 @@ class ChatServer:
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
+            self.server_socket.setblocking(False)
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
             self.running = True
             
             logging.info(f"Chat server started on port {self.port}")
             
-            # Start connection thread
-            conn_thread = threading.Thread(target=self._handle_connections)
-            conn_thread.daemon = True
-            conn_thread.start()
+            # A single I/O thread serves the listening socket and every client
+            loop_thread = threading.Thread(target=self._event_loop)
+            loop_thread.daemon = True
+            loop_thread.start()
             
             return True
         except Exception as e:
             logging.error(f"Failed to start server: {e}")
             return False
 
-    def _handle_connections(self):
-        """Accept and handle incoming connections"""
+    def _event_loop(self):
+        """Dispatch readiness events for the listening socket and all clients"""
         while self.running:
+            timeout = max(0.0, self._flush_deadline - time.monotonic()) if self._pending else 1.0
             try:
-                client, address = self.server_socket.accept()
-                self.addresses[client] = address
-                logging.info(f"New connection from {address[0]}")
-                
-                client_thread = threading.Thread(
-                    target=self._handle_client,
-                    args=(client,)
-                )
-                client_thread.daemon = True
-                client_thread.start()
-            except Exception as e:
+                events = self.selector.select(timeout=timeout)
+            except (OSError, ValueError) as e:
                 if self.running:
-                    logging.error(f"Connection handling error: {e}")
+                    logging.error(f"Event loop error: {e}")
+                break
+            
+            for key, mask in events:
+                if key.fileobj is self.server_socket:
+                    self._accept_connection()
+                    continue
+                
+                client = key.fileobj
+                if client not in self.addresses:
+                    continue  # removed while handling an earlier event in this batch
+                if mask & selectors.EVENT_READ:
+                    self._handle_client(client, key.data)
+                if mask & selectors.EVENT_WRITE and client in self.addresses:
+                    self._flush(client, key.data)
+            
+            if self._pending and time.monotonic() >= self._flush_deadline:
+                self._flush_pending()
+
+    def _accept_connection(self):
+        """Accept a pending connection and register it with the selector"""
+        try:
+            client, address = self.server_socket.accept()
+        except BlockingIOError:
+            return
+        except Exception as e:
+            if self.running:
+                logging.error(f"Connection handling error: {e}")
+            return
+        
+        client.setblocking(False)
+        # Batching already happens in the outbox, so don't let Nagle delay it further
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.addresses[client] = address
+        self.selector.register(client, selectors.EVENT_READ, ClientState())
+        logging.info(f"New connection from {address[0]}")
+        
+        self._send_bytes(client, self._MSG_ASK_USERNAME)
 
-    def _handle_client(self, client: socket.socket):
-        """Handle individual client connections"""
+    def _handle_client(self, client: socket.socket, state: ClientState):
+        """Read available data from a client and dispatch every complete message"""
         address = self.addresses[client][0]
         
         try:
-            username = self._get_username(client)
-            self.users[client] = username
-            
-            self._send_message(client, f"Welcome {username}! Type /help for commands.")
-            self.broadcast(f"{username} has joined the chat!")
-            
-            self._process_client_messages(client, username)
-            
+            for frame in iter_frames(client, state.buffer, RECV_CHUNK, MAX_FRAME_BYTES):
+                message = frame.decode("utf8")
+                
+                if state.username is None:
+                    self._handle_username(client, state, message.strip())
+                elif message:
+                    self._process_client_message(client, state.username, message)
+                
+                if client not in self.addresses:
+                    break
+        except BlockingIOError:
+            pass
+        except EOFError:
+            self._remove_client(client)
         except Exception as e:
             logging.error(f"Error handling client {address}: {e}")
-        finally:
             self._remove_client(client)
 
-    def _process_client_messages(self, client: socket.socket, username: str):
-        """Process messages from a specific client"""
-        while self.running:
-            try:
-                message = client.recv(2048).decode("utf8")
-                
-                if not message:
-                    break
-                
-                if message.startswith('/'):
-                    self._handle_command(client, message, username)
-                else:
-                    timestamp = datetime.now().strftime("%H:%M:%S")
-                    self.broadcast(f"[{timestamp}] {username}: {message}")
-                    
-            except Exception as e:
-                logging.error(f"Error processing message from {username}: {e}")
-                break
+    def _process_client_message(self, client: socket.socket, username: str, message: str):
+        """Process a single message from a client"""
+        if message.startswith('/'):
+            self._handle_command(client, message, username)
+        else:
+            timestamp = _hms_now()
+            self.broadcast(f"[{timestamp}] {username}: {message}")
 
     def _handle_command(self, client: socket.socket, command: str, username: str):
         """Handle client commands"""
-        commands = {
-            '/quit': lambda: self._handle_quit(client, username),
-            '/online': lambda: self._show_online_users(client),
-            '/help': lambda: self._show_help(client),
-            '/whisper': lambda: self._handle_whisper(client, command, username)
-        }
-        
-        cmd = command.split()[0]
-        if cmd in commands:
-            commands[cmd]()
+        handler = self.commands.get(command.split(None, 1)[0])
+        if handler:
+            handler(client, command, username)
         else:
-            self._send_message(client, "Unknown command. Type /help for available commands.")
+            self._send_bytes(client, self._MSG_UNKNOWN_COMMAND)
 
-    def _handle_quit(self, client: socket.socket, username: str):
+    def _handle_quit(self, client: socket.socket, command: str, username: str):
         """Handle client quit command"""
-        self._send_message(client, "Goodbye!")
+        self._send_bytes(client, self._MSG_GOODBYE)
         self._remove_client(client)
         self.broadcast(f"{username} has left the chat.")
 
-    def _show_online_users(self, client: socket.socket):
+    def _show_online_users(self, client: socket.socket, command: str, username: str):
         """Send list of online users to client"""
         online_users = ', '.join(sorted(self.users.values()))
         self._send_message(client, f"Users online: {online_users}")
 
-    def _show_help(self, client: socket.socket):
+    def _show_help(self, client: socket.socket, command: str, username: str):
         """Send help message to client"""
-        help_text = """
-Available commands:
-/help - Show this help message
-/online - Show online users
-/quit - Leave the chat
-/whisper <username> <message> - Send private message
-        """
-        self._send_message(client, help_text)
+        self._send_bytes(client, self._MSG_HELP)
 
     def _handle_whisper(self, client: socket.socket, command: str, sender: str):
         """Handle private messages between users"""
@@ -144,10 +207,7 @@ Available commands:
             _, recipient, *message_parts = command.split()
             message = ' '.join(message_parts)
             
-            recipient_socket = next(
-                (sock for sock, name in self.users.items() if name == recipient),
-                None
-            )
+            recipient_socket = self.names.get(recipient)
             
             if recipient_socket:
                 self._send_message(recipient_socket, f"[PM from {sender}] {message}")
@@ -155,51 +215,118 @@ Available commands:
             else:
                 self._send_message(client, f"User {recipient} is not online.")
         except ValueError:
-            self._send_message(client, "Usage: /whisper <username> <message>")
+            self._send_bytes(client, self._MSG_WHISPER_USAGE)
 
-    def _get_username(self, client: socket.socket) -> str:
-        """Get unique username from client"""
-        while True:
-            self._send_message(client, "Enter your username:")
-            username = client.recv(2048).decode("utf8").strip()
-            
-            if username and username not in self.users.values():
-                return username
-            
-            self._send_message(client, "Username already taken or invalid. Try again.")
+    def _handle_username(self, client: socket.socket, state: ClientState, username: str):
+        """Admit the client under a unique username, or ask for another one"""
+        if not username or username in self.names:
+            self._send_bytes(client, self._MSG_USERNAME_RETRY)
+            return
+        
+        state.username = username
+        self.users[client] = username
+        self.names[username] = client
+        self._update_snapshot()
+        
+        self._send_message(client, f"Welcome {username}! Type /help for commands.")
+        self.broadcast(f"{username} has joined the chat!")
 
     def _remove_client(self, client: socket.socket):
         """Remove client from server"""
         if client in self.users:
+            self.names.pop(self.users[client], None)
             del self.users[client]
+            self._update_snapshot()
         if client in self.addresses:
             del self.addresses[client]
+        self._pending.discard(client)
+        try:
+            self.selector.unregister(client)
+        except (KeyError, ValueError):
+            pass
         try:
             client.close()
         except:
             pass
 
+    def _update_snapshot(self):
+        """Rebuild the tuple of sockets that broadcast iterates over"""
+        self._sockets_snapshot = tuple(self.users)
+
     def _send_message(self, client: socket.socket, message: str):
         """Send message to specific client"""
+        self._send_bytes(client, message.encode("utf8") + b"\n")
+
+    def _send_bytes(self, client: socket.socket, data: bytes, defer: bool = False):
+        """Queue an already-framed payload for a client; deferred payloads wait for the next batch flush"""
+        try:
+            state = self.selector.get_key(client).data
+        except (KeyError, ValueError):
+            return
+        state.outbox.extend(data)
+        
+        if len(state.outbox) > MAX_OUTBOX_BYTES:
+            logging.warning(f"Disconnecting slow client {self.addresses[client][0]}: output backlog too large")
+            self._remove_client(client)
+            return
+        
+        if defer and len(state.outbox) < BATCH_FLUSH_BYTES:
+            if not self._pending:
+                self._flush_deadline = time.monotonic() + BATCH_INTERVAL
+            self._pending.add(client)
+            return
+        
+        self._pending.discard(client)
+        self._flush(client, state)
+
+    def _flush_pending(self):
+        """Send every outbox that is holding deferred broadcast data"""
+        pending, self._pending = self._pending, set()
+        for client in pending:
+            try:
+                self._flush(client, self.selector.get_key(client).data)
+            except (KeyError, ValueError):
+                pass
+
+    def _flush(self, client: socket.socket, state: ClientState):
+        """Write as much of the client's outbox as the socket accepts without blocking"""
         try:
-            client.send(message.encode("utf8"))
+            sent = client.send(state.outbox)
+            del state.outbox[:sent]
+        except BlockingIOError:
+            pass
         except Exception as e:
             logging.error(f"Error sending message to client: {e}")
+            state.outbox.clear()
+        
+        # Only watch for writability while there is data left to send
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if state.outbox else selectors.EVENT_READ
+        try:
+            if self.selector.get_key(client).events != events:
+                self.selector.modify(client, events, state)
+        except (KeyError, ValueError):
+            pass
 
     def broadcast(self, message: str, exclude: socket.socket = None):
         """Broadcast message to all clients except excluded one"""
-        for client in list(self.users.keys()):
-            if client != exclude:
-                self._send_message(client, message)
+        data = message.encode("utf8") + b"\n"
+        for client in self._sockets_snapshot:
+            if client is not exclude:
+                self._send_bytes(client, data, defer=True)
 
     def shutdown(self):
         """Shutdown the server"""
         self.running = False
         if self.server_socket:
+            try:
+                self.selector.unregister(self.server_socket)
+            except (KeyError, ValueError):
+                pass
             self.server_socket.close()
         
-        for client in list(self.users.keys()):
+        for client in list(self.addresses.keys()):
             self._remove_client(client)
+        self.selector.close()
         
         logging.info("Server shutdown complete")
 